@@ -3,6 +3,7 @@ from __future__ import print_function
 
 import os
 import shutil
+import sys
 import tempfile
 
 import mock
@@ -19,26 +20,44 @@ from pygame.locals import (
 from pyspacewar.ui import key_name
 
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
 class SurfaceStub(object):
 
     def __init__(self, size=(800, 600), bitsize=32):
-        self.w, self.h = size
+        w, h = size
+        self._size = (w, h)
         self.alpha = 255
         self.colorkey = None
         self.bitsize = bitsize
         self._ops = []
+        self._append_op = self._ops.append
+
+    def _set_w(self, w):
+        self._size = (w, self._size[1])
+
+    def _set_h(self, h):
+        self._size = (self._size[0], h)
+
+    w = property(lambda self: self._size[0], _set_w)
+    h = property(lambda self: self._size[1], _set_h)
 
     def get_width(self):
-        return self.w
+        return self._size[0]
 
     def get_height(self):
-        return self.h
+        return self._size[1]
 
     def get_size(self):
-        return (self.w, self.h)
+        return self._size
 
     def get_rect(self):
-        return Rect(0, 0, self.w, self.h)
+        # Rects are mutable, so this one can't be cached
+        return Rect((0, 0), self._size)
 
     def get_bitsize(self):
         return self.bitsize
@@ -46,19 +65,37 @@ class SurfaceStub(object):
     def set_alpha(self, alpha):
         self.alpha = alpha
 
+    def lock(self):
+        pass
+
+    def unlock(self):
+        pass
+
     def set_colorkey(self, color):
         r, g, b = color
         self.colorkey = (r, g, b)
 
+    _color_names = {}  # shared by all surfaces; the palette is small
+
+    def map_rgb(self, color):
+        r, g, b = color
+        return (r << 16) | (g << 8) | b
+
     def _fmt_color(self, color):
+        if isinstance(color, int):
+            color = (color >> 16, (color >> 8) & 0xff, color & 0xff)
         if color == self.colorkey:
             return '<colorkey>'
         r, g, b = color
-        return "#%02x%02x%02x" % (r, g, b)
+        try:
+            return self._color_names[r, g, b]
+        except KeyError:
+            name = self._color_names[r, g, b] = "#%02x%02x%02x" % (r, g, b)
+            return name
 
     def set_at(self, pos, color):
         x, y = pos
-        self._record("(%s, %s) <- %s" % (x, y, self._fmt_color(color)))
+        self._record("(%s, %s) <- %s", x, y, self._fmt_color(color))
 
     def blit(self, what, pos, area=None):
         x, y = pos
@@ -69,47 +106,61 @@ class SurfaceStub(object):
             subset = ""
         if isinstance(what, SurfaceStub) and what.alpha != 255:
             subset += "[alpha=%s]" % what.alpha
-        self._record("(%s, %s) <- %r%s" % (x, y, what, subset))
-        if isinstance(what, SurfaceStub):
-            for op in what._ops:
-                self._record("  %s" % op)
+        self._record("(%s, %s) <- %r%s", x, y, what, subset)
+        ops = getattr(what, '_ops', None)
+        if ops:
+            for fmt, args in ops:
+                self._record("  " + fmt, *args)
 
     def fill(self, color, rect=None):
         if not rect:
             # clearing the entire surface makes previous drawing operations
-            # irrelevant
-            self._ops = []
-        x, y, w, h = rect or (0, 0, self.w, self.h)
-        self._record("(%s, %s)..(%s, %s) <- fill(%s)" % (
-            x, y, x + w - 1, y + h - 1, self._fmt_color(color)))
+            # irrelevant (clear in place, _append_op is bound to this list)
+            del self._ops[:]
+            w, h = self._size
+            self._record("(0, 0)..(%s, %s) <- fill(%s)",
+                         w - 1, h - 1, self._fmt_color(color))
+            return
+        x, y, w, h = rect
+        self._record("(%s, %s)..(%s, %s) <- fill(%s)",
+                     x, y, x + w - 1, y + h - 1, self._fmt_color(color))
 
     def _rect(self, color, rect, line_width):
         x, y, w, h = rect
-        self._record("(%s, %s)..(%s, %s) <- rect(%s, %s)" % (
-            x, y, x + w - 1, y + h - 1, self._fmt_color(color), line_width))
+        self._record("(%s, %s)..(%s, %s) <- rect(%s, %s)",
+                     x, y, x + w - 1, y + h - 1, self._fmt_color(color),
+                     line_width)
 
     def _line(self, color, pt1, pt2):
         x1, y1 = pt1
         x2, y2 = pt2
-        self._record("(%s, %s)..(%s, %s) <- line(%s)" % (
-            x1, y1, x2, y2, self._fmt_color(color)))
+        self._record("(%s, %s)..(%s, %s) <- line(%s)",
+                     x1, y1, x2, y2, self._fmt_color(color))
 
     def _aaline(self, color, pt1, pt2):
         x1, y1 = pt1
         x2, y2 = pt2
-        self._record("(%s, %s)..(%s, %s) <- aaline(%s)" % (
-            x1, y1, x2, y2, self._fmt_color(color)))
+        self._record("(%s, %s)..(%s, %s) <- aaline(%s)",
+                     x1, y1, x2, y2, self._fmt_color(color))
 
     def _circle(self, color, center, radius, width=0):
         x, y = center
-        extra = []
         if width:
-            extra.append("width=%s" % width)
-        self._record("(%s, %s) <- circle(%s, %s%s)" % (
-            x, y, self._fmt_color(color), radius, ", ".join(extra)))
+            self._record("(%s, %s) <- circle(%s, %s, width=%s)",
+                         x, y, self._fmt_color(color), radius, width)
+        else:
+            self._record("(%s, %s) <- circle(%s, %s)",
+                         x, y, self._fmt_color(color), radius)
 
-    def _record(self, op):
-        self._ops.append(op)
+    def _record(self, fmt, *args):
+        # Formatting is deferred until somebody wants to print the op
+        self._append_op((fmt, args))
+
+    @staticmethod
+    def _format_op(fmt, args):
+        if not args:
+            return fmt
+        return fmt % args
 
     def __repr__(self):
         return '<Surface(%dx%d)>' % (self.w, self.h)
@@ -121,9 +172,11 @@ class PrintingSurfaceStub(SurfaceStub):
         super(PrintingSurfaceStub, self).__init__(size, bitsize)
         self.filter = filter
 
-    def _record(self, op):
+    def _record(self, fmt, *args):
+        op = self._format_op(fmt, args)
         if not self.filter or self.filter(op):
-            print(op)
+            # sys.stdout must be looked up every time: doctest replaces it
+            sys.stdout.write(op + '\n')
 
 
 class TextSurfaceStub(SurfaceStub):
@@ -141,10 +194,17 @@ class TextSurfaceStub(SurfaceStub):
 
 class FontStub(object):
 
+    def __init__(self):
+        self._sizes = {}
+
     def size(self, text):
-        w = len(text) * 10
-        h = 16
-        return (w, h)
+        try:
+            return self._sizes[text]
+        except KeyError:
+            w = len(text) * 10
+            h = 16
+            size = self._sizes[text] = (w, h)
+            return size
 
     def get_linesize(self):
         return 16
@@ -182,34 +242,45 @@ class TransformStub(object):
 
 class DrawStub(object):
 
+    # Real pygame surfaces (e.g. the GameUI screen) lack the _rect/_line/etc.
+    # recording methods, so drawing on them is silently ignored.
+
     def rect(self, surface, color, rect, line_width):
-        if isinstance(surface, SurfaceStub):
-            surface._rect(color, rect, line_width)
+        draw = getattr(surface, '_rect', None)
+        if draw is not None:
+            draw(color, rect, line_width)
 
     def line(self, surface, color, pt1, pt2):
-        if isinstance(surface, SurfaceStub):
-            surface._line(color, pt1, pt2)
+        draw = getattr(surface, '_line', None)
+        if draw is not None:
+            draw(color, pt1, pt2)
 
     def aaline(self, surface, color, pt1, pt2):
-        if isinstance(surface, SurfaceStub):
-            surface._aaline(color, pt1, pt2)
+        draw = getattr(surface, '_aaline', None)
+        if draw is not None:
+            draw(color, pt1, pt2)
 
     def circle(self, surface, color, center, radius, width=0):
-        if isinstance(surface, SurfaceStub):
-            surface._circle(color, center, radius, width)
+        draw = getattr(surface, '_circle', None)
+        if draw is not None:
+            draw(color, center, radius, width)
 
 
 def array_alpha_stub(surface):
-    import numpy
-    size = surface.get_size()
-    array = numpy.empty(size, numpy.uint8)
-    return array
+    # Like pygame's, this returns a new array; callers keep it around
+    return numpy.empty(surface.get_size(), numpy.uint8)
+
+
+_pixels_alpha_arrays = {}
 
 
 def pixels_alpha_stub(surface):
-    import numpy
+    # pygame returns a view into the surface, which gets overwritten and
+    # never read back, so one scratch array per size will do
     size = surface.get_size()
-    array = numpy.empty(size, numpy.uint8)
+    array = _pixels_alpha_arrays.get(size)
+    if array is None:
+        array = _pixels_alpha_arrays[size] = numpy.empty(size, numpy.uint8)
     return array
 
 
@@ -333,8 +404,9 @@ def doctest_Viewport_keep_visible():
         >>> from pyspacewar.ui import Viewport
         >>> viewport = Viewport(SurfaceStub())
 
-    Points that are already visible change nothing
+    Points that are already visible change nothing (and neither do no points)
 
+        >>> viewport.keep_visible([], 10)
         >>> viewport.keep_visible([Vector(0, 0)], 10)
         >>> viewport.keep_visible([Vector(100, 100)], 10)
         >>> viewport.keep_visible([Vector(-200, -100)], 10)
@@ -421,7 +493,8 @@ def doctest_FrameRateCounter_frame():
         >>> len(frc.frames)
         2
 
-        >>> frc.frames = list(range(frc.avg_last_n_frames - 1))
+        >>> frc.reset()
+        >>> frc.frames.extend(range(frc.avg_last_n_frames - 1))
         >>> frc.frame()
         >>> len(frc.frames) == frc.avg_last_n_frames
         True
@@ -432,7 +505,7 @@ def doctest_FrameRateCounter_frame():
         >>> len(frc.frames) == frc.avg_last_n_frames
         True
 
-        >>> frc.frames[:3]
+        >>> list(frc.frames)[:3]
         [2, 3, 4]
 
     """
@@ -445,7 +518,7 @@ def doctest_FrameRateCounter_reset():
         >>> frc = FrameRateCounter()
         >>> frc.frames = list(range(15))
         >>> frc.reset()
-        >>> frc.frames
+        >>> list(frc.frames)
         []
 
     """
@@ -644,6 +717,52 @@ def doctest_HUDFormattedText():
     """
 
 
+def doctest_HUDFormattedText_render_text_caches_layout():
+    """Test for HUDFormattedText.render_text
+
+        >>> from pyspacewar.ui import HUDFormattedText
+        >>> font = FontStub()
+        >>> bold_font = FontStub()
+        >>> help_text = HUDFormattedText(font, bold_font, 'Hello')
+
+        >>> layout_pages = help_text.layout_pages
+        >>> def traced_layout_pages(text, page_size):
+        ...     print("layout_pages(%r, %r)" % (text, page_size))
+        ...     return layout_pages(text, page_size)
+        >>> help_text.layout_pages = traced_layout_pages
+
+    The text is laid out only once for as long as nothing changes
+
+        >>> help_text.render_text(SurfaceStub(), Rect(0, 0, 300, 100))
+        layout_pages('Hello', (300, 68))
+        >>> help_text.render_text(SurfaceStub(), Rect(0, 0, 300, 100))
+
+    but it is laid out again when the page size changes
+
+        >>> help_text.render_text(SurfaceStub(), Rect(0, 0, 400, 100))
+        layout_pages('Hello', (400, 68))
+
+    or when the text changes
+
+        >>> help_text.text = 'Bye'
+        >>> help_text.render_text(SurfaceStub(), Rect(0, 0, 400, 100))
+        layout_pages('Bye', (400, 68))
+
+    or the fonts or colour used to render it
+
+        >>> help_text.font = FontStub()
+        >>> help_text.render_text(SurfaceStub(), Rect(0, 0, 400, 100))
+        layout_pages('Bye', (400, 68))
+        >>> help_text.bold_font = FontStub()
+        >>> help_text.render_text(SurfaceStub(), Rect(0, 0, 400, 100))
+        layout_pages('Bye', (400, 68))
+        >>> help_text.color = (0xff, 0xcc, 0x80)
+        >>> help_text.render_text(SurfaceStub(), Rect(0, 0, 400, 100))
+        layout_pages('Bye', (400, 68))
+
+    """
+
+
 def doctest_HUDFormattedText_layout_pages_last_paragraph_has_keep_with_next():
     """Test for HUDFormattedText.layout_pages
 
@@ -730,6 +849,26 @@ def doctest_HUDInfoPanel():
         (11, 27) <- 'Lon'
         (79, 27) <- '-55'
 
+    Rendered text is cached
+
+        >>> panel.render('Lat', panel.color1) is panel.render('Lat',
+        ...                                                   panel.color1)
+        True
+        >>> panel.render('Lat', panel.color1) is panel.render('Lat',
+        ...                                                   panel.color2)
+        False
+
+    but not indefinitely
+
+        >>> panel.MAX_CACHED_RENDERS = 3
+        >>> img = panel.render('Lat', panel.color1)
+        >>> for n in range(5):
+        ...     _ = panel.render(str(n), panel.color1)
+        >>> len(panel._render_cache)
+        2
+        >>> panel.render('Lat', panel.color1) is img
+        False
+
     """
 
 
@@ -839,12 +978,45 @@ def doctest_HUDTitle_FadingImage():
     """
 
 
+def doctest_HUDTitle_AlphaFadingImage():
+    """Test for HUDTitle
+
+        >>> from pyspacewar.ui import HUDTitle, AlphaFadingImage
+        >>> title = HUDTitle(ImageStub())
+        >>> title.image = AlphaFadingImage(ImageStub())
+        >>> title.draw(PrintingSurfaceStub())
+        (350, 135) <- <Image(100x80)>
+
+    Each frame also drops the alpha level
+
+        >>> title.alpha
+        242.25
+        >>> title.draw(PrintingSurfaceStub())
+        (350, 135) <- <Image(100x80)>[alpha=242.25]
+        >>> title.alpha
+        230.1375
+
+    Eventually the image becomes invisible
+
+        >>> title.alpha = 0.95
+        >>> title.draw(PrintingSurfaceStub())
+
+    This needs pygame 2
+
+        >>> pygame_version = mock.patch('pygame.version.vernum', (1, 9, 6))
+        >>> with pygame_version:
+        ...     AlphaFadingImage(ImageStub())
+        Traceback (most recent call last):
+          ...
+        ImportError: surface alpha with per-pixel alpha needs pygame 2
+
+    """
+
+
 def doctest_HUDTitle_NumPyFadingImage():
     """Test for HUDTitle
 
-        >>> try:
-        ...     import numpy  # noqa: F401
-        ... except ImportError:
+        >>> if numpy is None:
         ...     pytest.skip('needs numpy')
         >>> from pyspacewar.ui import HUDTitle, NumPyFadingImage
         >>> title = HUDTitle(ImageStub())
@@ -852,6 +1024,14 @@ def doctest_HUDTitle_NumPyFadingImage():
         >>> title.draw(PrintingSurfaceStub())
         (350, 135) <- <Image(100x80)>
 
+    The original alpha channel is kept in a copy that fading won't overwrite
+
+        >>> mask = title.image.mask
+        >>> mask is pygame.surfarray.pixels_alpha(title.image.image)
+        False
+        >>> mask is NumPyFadingImage(ImageStub()).mask
+        False
+
     Each frame also drops the alpha level, which is reflected directly
     in the image alpha channel via numpy array operations that we cannot
     easily see in this doctest
@@ -1047,6 +1227,34 @@ def doctest_HUDInput():
           (759, 0) <- <colorkey>
           (759, 31) <- <colorkey>
 
+    The buffer surface is reused while the screen size stays the same
+
+        >>> buffer = input.buffer
+        >>> input.text = '42'
+        >>> input.draw(PrintingSurfaceStub())
+        (20, 448) <- <Surface(760x32)>[alpha=204]
+          (0, 0)..(759, 31) <- fill(#010208)
+          (8, 8) <- 'How much?'
+          (98, 8) <- '42'
+          (0, 0) <- <colorkey>
+          (0, 31) <- <colorkey>
+          (759, 0) <- <colorkey>
+          (759, 31) <- <colorkey>
+        >>> input.buffer is buffer
+        True
+
+        >>> input.draw(PrintingSurfaceStub((640, 480)))
+        (20, 328) <- <Surface(600x32)>[alpha=204]
+          (0, 0)..(599, 31) <- fill(#010208)
+          (8, 8) <- 'How much?'
+          (98, 8) <- '42'
+          (0, 0) <- <colorkey>
+          (0, 31) <- <colorkey>
+          (599, 0) <- <colorkey>
+          (599, 31) <- <colorkey>
+        >>> input.buffer is buffer
+        False
+
     """
 
 
@@ -1262,12 +1470,12 @@ class KeyEventStub(object):
             self.unicode = unicode
 
 
-class PressedKeysStub(dict):
+class PressedKeysStub(object):
 
     def __init__(self, *pressed):
-        self.pressed = pressed
+        self.pressed = frozenset(pressed)
 
-    def __missing__(self, key):
+    def __getitem__(self, key):
         return key in self.pressed
 
 
@@ -3005,6 +3213,13 @@ def doctest_GameUI_missile_trails():
 
         >>> ui.draw_missile_trails()
 
+    Trail colors are mapped to pixel values once and reused
+
+        >>> colors = ui.trail_colors[missile.appearance][5]
+        >>> ui.trail_pixels[missile.appearance, 5] == [
+        ...     ui.screen.map_rgb(color) for color in colors]
+        True
+
         >>> missile.explode()
         >>> for n in range(ui.MAX_TRAIL + 1):
         ...     ui.update_missile_trails()
@@ -3018,7 +3233,7 @@ def doctest_GameUI_missile_trails():
 def doctest_GameUI_draw_Missile():
     """Test for GameUI.draw_Missile
 
-        >>> from pyspacewar.ui import GameUI
+        >>> from pyspacewar.ui import GameUI, colorblend
         >>> ui = GameUI()
         >>> ui.init()
         >>> ui.start_single_player_game()
@@ -3027,6 +3242,48 @@ def doctest_GameUI_draw_Missile():
         >>> [(missile, trail)] = ui.missile_trails.items()
         >>> ui.draw_Missile(missile)
 
+    Missile colors are mapped to pixel values once and reused
+
+        >>> color = ui.ship_colors[missile.appearance]
+        >>> ui.missile_pixels[missile.appearance] == (
+        ...     ui.screen.map_rgb(color),
+        ...     ui.screen.map_rgb(colorblend(color, (0, 0, 0), 0.4)))
+        True
+
+    """
+
+
+def doctest_GameUI_draw_Planet():
+    """Test for GameUI.draw_Planet
+
+        >>> from pyspacewar.ui import GameUI
+        >>> from pyspacewar.world import Planet, Vector
+        >>> ui = GameUI()
+        >>> ui.init()
+        >>> ui.screen = PrintingSurfaceStub()
+        >>> ui.viewport.origin = Vector(0, 0)
+        >>> ui.viewport.scale = 1
+        >>> planet = Planet(Vector(0, 0), radius=20)
+        >>> ui.draw_Planet(planet)
+        (300.0, 220.0) <- <Image(40x40)>
+
+    Scaled planet images are cached
+
+        >>> img = ui.scaled_planet_images[0, 40]
+        >>> ui.draw_Planet(planet)
+        (300.0, 220.0) <- <Image(40x40)>
+        >>> ui.scaled_planet_images[0, 40] is img
+        True
+
+    but not too many of them
+
+        >>> ui.MAX_SCALED_PLANETS = 1
+        >>> ui.viewport.scale = 2
+        >>> ui.draw_Planet(planet)
+        (280.0, 200.0) <- <Image(80x80)>
+        >>> sorted(ui.scaled_planet_images)
+        [(0, 80)]
+
     """
 
 
@@ -3062,11 +3319,9 @@ def doctest_GameUI_wait_for_tick():
     """
 
 
-@pytest.fixture(autouse=True)
+@pytest.fixture(scope='module', autouse=True)
 def pytest_setup():
-    os.environ['SDL_VIDEODRIVER'] = 'dummy'
-    os.environ['SDL_AUDIODRIVER'] = 'dummy'
-    pygame.init()  # so that pygame.key.name() works
+    # pygame.init() is done once per session in conftest.py
     pygame.display.list_modes = lambda: [(800, 600), (640, 480)]
     pygame.display.set_icon = lambda icon: None
     pygame.draw = DrawStub()
@@ -3075,5 +3330,9 @@ def pytest_setup():
     pygame.Surface = SurfaceStub
     pygame.surfarray.array_alpha = array_alpha_stub
     pygame.surfarray.pixels_alpha = pixels_alpha_stub
+
+
+@pytest.fixture(autouse=True)
+def stop_patches():
     yield
     mock.patch.stopall()
@@ -130,6 +130,92 @@ def doctest_World_collision_detection_in_update():
     """
 
 
+def doctest_World_sweep_and_prune():
+    """Tests for collision detection in large worlds
+
+        >>> from pyspacewar.world import World, Planet, Debris, Vector
+        >>> w = World()
+        >>> w.add(Planet(Vector(0, 0), radius=10, appearance='sun'))
+        >>> w.add(Planet(Vector(15, 30), radius=10, appearance='moon'))
+        >>> w.add(Planet(Vector(100, 0), radius=5, appearance='rock'))
+        >>> w.add(Debris(Vector(-5, 50), appearance='junk'))
+        >>> w.add(Debris(Vector(98, 0), appearance='dust'))
+        >>> w.add(Debris(Vector(50, 0), appearance='lonely'))
+
+    Only objects that overlap along the x axis are considered for collision
+    detection; collide() then makes the final decision
+
+        >>> for obj1, obj2 in w._overlapping_pairs():
+        ...     print(obj1.appearance, obj2.appearance)
+        sun moon
+        sun junk
+        rock dust
+
+    The pairs come in the same order as those from _all_pairs(), since
+    collision handlers may move objects and the order affects the outcome
+
+        >>> pairs = w._overlapping_pairs()
+        >>> [pair for pair in w._all_pairs() if pair in pairs] == pairs
+        True
+
+    update() uses this for worlds with many objects
+
+        >>> checked = []
+        >>> orig_collide = w.collide
+        >>> def collide(obj1, obj2):
+        ...     checked.append((obj1.appearance, obj2.appearance))
+        ...     return orig_collide(obj1, obj2)
+        >>> w.collide = collide
+
+        >>> w.SWEEP_AND_PRUNE_MIN = 5
+        >>> w.update(1.0)
+        >>> for obj1, obj2 in checked:
+        ...     print(obj1, obj2)
+        sun moon
+        sun junk
+        rock dust
+
+    The lonely debris was never even looked at.  Smaller worlds check
+    every pair
+
+        >>> del checked[:]
+        >>> w.SWEEP_AND_PRUNE_MIN = 100
+        >>> w.update(1.0)
+        >>> len(checked)
+        12
+        >>> [pair for pair in checked if 'lonely' in pair]
+        [('sun', 'lonely'), ('moon', 'lonely'), ('rock', 'lonely')]
+
+    """
+
+
+def doctest_World_sweep_and_prune_objects_without_position():
+    """Test for collision detection in large worlds
+
+    Objects in the world are not required to have a position, so sweep and
+    prune cannot work with them and all pairs get checked instead
+
+        >>> from pyspacewar.world import World
+        >>> class QuietObject(Object):
+        ...     def move(self, dt):
+        ...         pass
+        >>> w = World()
+        >>> for n in range(16):
+        ...     w.add(QuietObject('o%d' % n, radius=1))
+        >>> len(w.objects) >= w.SWEEP_AND_PRUNE_MIN
+        True
+
+        >>> w._overlapping_pairs() == list(w._all_pairs())
+        True
+
+        >>> w.collide = lambda a, b: a.name == 'o0' and b.name == 'o15'
+        >>> w.update(1.0)
+        o0 collides with o15
+        o15 collides with o0
+
+    """
+
+
 def doctest_World_death_and_birth_in_update():
     """Test for spawning and removing objects during update
 
@@ -179,6 +265,9 @@ def doctest_World_death_and_birth_in_update():
         >>> w.objects
         [o1, o3, o5]
 
+        >>> o2.world is None, o4.world is None
+        (True, True)
+
     You can even do insane combinations of addition and removal
 
         >>> def my_move(dt):
@@ -2,6 +2,7 @@
 Graphical user interface for PySpaceWar
 """
 
+import collections
 import glob
 import itertools
 import math
@@ -367,32 +368,38 @@ class Viewport(object):
               for x, y in [self.screen_pos(pt) for pt in points]
 
         """
+        if not points:
+            return
+        xs = [pt[0] for pt in points]
+        ys = [pt[1] for pt in points]
         if len(points) > 1:
-            xs = [pt.x for pt in points]
-            ys = [pt.y for pt in points]
             w = max(xs) - min(xs)
             h = max(ys) - min(ys)
             xmin, ymin, xmax, ymax = self.world_inner_bounds(margin)
             seen_w = xmax - xmin
             seen_h = ymax - ymin
-            factor = 1.0
-            while seen_w < w or seen_h < h:
-                factor *= self.AUTOSCALE_FACTOR
-                seen_w *= self.AUTOSCALE_FACTOR
-                seen_h *= self.AUTOSCALE_FACTOR
-            if factor != 1.0:
-                self.scale /= factor
-
-        for pt in points:
-            xmin, ymin, xmax, ymax = self.world_inner_bounds(margin)
-            if pt.x < xmin:
-                self.origin -= Vector(xmin - pt.x, 0)
-            elif pt.x > xmax:
-                self.origin -= Vector(xmax - pt.x, 0)
-            if pt.y < ymin:
-                self.origin -= Vector(0, ymin - pt.y)
-            elif pt.y > ymax:
-                self.origin -= Vector(0, ymax - pt.y)
+            ratio = max(w / seen_w, h / seen_h)
+            if ratio > 1.0:
+                # Zoom out in steps of AUTOSCALE_FACTOR, by as many steps as
+                # needed to see everything
+                steps = math.ceil(math.log(ratio) /
+                                  math.log(self.AUTOSCALE_FACTOR))
+                self.scale /= self.AUTOSCALE_FACTOR ** steps
+
+        # Shift the origin once, by the smallest amount that brings all the
+        # points inside
+        xmin, ymin, xmax, ymax = self.world_inner_bounds(margin)
+        dx = dy = 0
+        if min(xs) < xmin:
+            dx = min(xs) - xmin
+        elif max(xs) > xmax:
+            dx = max(xs) - xmax
+        if min(ys) < ymin:
+            dy = min(ys) - ymin
+        elif max(ys) > ymax:
+            dy = max(ys) - ymax
+        if dx or dy:
+            self.origin += Vector(dx, dy)
 
     def world_inner_bounds(self, margin):
         """Calculate the rectange in world coordinates that fits inside a
@@ -418,20 +425,19 @@ class FrameRateCounter(object):
     get_ticks = staticmethod(pygame.time.get_ticks)
 
     def __init__(self):
-        self.frames = []
+        self.reset()
 
     def frame(self):
         """Tell the counter that a new frame has just been drawn."""
+        # the deque drops the oldest frame by itself
         self.frames.append(self.get_ticks())
-        if len(self.frames) > self.avg_last_n_frames:
-            del self.frames[0]
 
     def reset(self):
         """Tell the counter that we stopped drawing frames for a while.
 
         Call this method if you pause the game for a time.
         """
-        self.frames = []
+        self.frames = collections.deque(maxlen=self.avg_last_n_frames)
 
     def fps(self):
         """Calculate the frame rate.
@@ -536,6 +542,8 @@ class HUDFormattedText(HUDElement):
         self.yalign = yalign
         self.page = 0
         self.n_pages = -1
+        self._layout_key = None
+        self._layout = None
 
     def position(self, surface, margin=30):
         """Calculate screen position for the widget."""
@@ -681,7 +689,14 @@ class HUDFormattedText(HUDElement):
         paragraph_spacing = self.font.get_linesize()
         width, height = page_rect.size
         height -= self.small_font.get_linesize() * 2
-        pages = self.layout_pages(self.text, (width, height))
+        # Rendering and wrapping every word is slow, so keep the layout
+        # around for as long as nothing that goes into it changes
+        key = (self.text, self.font, self.bold_font, self.color,
+               (width, height))
+        if key != self._layout_key:
+            self._layout = self.layout_pages(self.text, (width, height))
+            self._layout_key = key
+        pages = self._layout
         self.n_pages = len(pages)
         if not pages:
             # This cannot happen due to the way str.split() works in
@@ -708,9 +723,12 @@ class HUDInfoPanel(HUDElement):
     STD_COLORS = [(0xff, 0xff, 0xff), (0xcc, 0xff, 0xff)]
     GREEN_COLORS = [(0x7f, 0xff, 0x00), (0xcc, 0xff, 0xff)]
 
+    MAX_CACHED_RENDERS = 200    # Keep at most this many rendered strings
+
     def __init__(self, font, ncols, nrows=None, xalign=0, yalign=0,
                  colors=STD_COLORS, content=None):
         self.font = font
+        self._render_cache = {}
         self.width = int(self.font.size('x')[0] * ncols)
         self.row_height = self.font.get_linesize()
         if nrows is None:
@@ -738,12 +756,27 @@ class HUDInfoPanel(HUDElement):
         x += 1
         y += 1
         for a, b in rows:
-            img = self.font.render(str(a), True, self.color1)
+            img = self.render(str(a), self.color1)
             surface.blit(img, (x, y))
-            img = self.font.render(str(b), True, self.color2)
+            img = self.render(str(b), self.color2)
             surface.blit(img, (x + self.width - 2 - img.get_width(), y))
             y += self.row_height
 
+    def render(self, text, color):
+        """Render a piece of text.
+
+        Most of the values shown on the panel stay the same from one frame to
+        the next, so rendered images are cached.
+        """
+        key = (text, color)
+        img = self._render_cache.get(key)
+        if img is None:
+            if len(self._render_cache) >= self.MAX_CACHED_RENDERS:
+                self._render_cache.clear()
+            img = self.font.render(text, True, color)
+            self._render_cache[key] = img
+        return img
+
     def draw(self, surface):
         """Draw the panel."""
         rows = []
@@ -815,6 +848,8 @@ class HUDCompass(HUDElement):
         self.viewport = viewport
         self.width = self.height = 2*self.radius
         self.surface = pygame.Surface((self.width, self.height))
+        self.surface.set_colorkey((1, 1, 1))
+        self.surface.set_alpha(self.alpha)
         self.bgcolor, self.fgcolor1, self.fgcolor2, self.fgcolor3 = colors
         self.xalign = xalign
         self.yalign = yalign
@@ -826,19 +861,18 @@ class HUDCompass(HUDElement):
         else:
             draw_line = pygame.draw.line
         x = y = self.radius
-        self.surface.set_colorkey((1, 1, 1))
         self.surface.fill((1, 1, 1))
-        self.surface.set_alpha(self.alpha)
 
         pygame.draw.circle(self.surface, self.bgcolor, (x, y), self.radius)
         self.surface.set_at((x, y), self.fgcolor1)
 
         scale = self.radar_scale * self.viewport.scale
+        radius_squared = self.radius ** 2
         for body in self.world.objects:
             if body.mass == 0:
                 continue
             pos = (body.position - self.ship.position) * scale
-            if pos.length() > self.radius:
+            if pos.dot_product(pos) > radius_squared:
                 continue
             radius = max(0, int(body.radius * scale))
             px = x + int(pos.x)
@@ -893,6 +927,28 @@ class FadingImage(object):
         surface.blit(self.image, (x, y))
 
 
+class AlphaFadingImage(object):
+    """An image that can smoothly fade away.
+
+    Relies on pygame 2 combining surface alpha with per-pixel alpha when
+    blitting, so there's no need to touch the pixels ourselves.
+    """
+
+    def __init__(self, image):
+        if pygame.version.vernum[0] < 2:
+            raise ImportError('surface alpha with per-pixel alpha'
+                              ' needs pygame 2')
+        self.image = image.convert_alpha()
+
+    def draw(self, surface, x, y, alpha):
+        """Draw the image.
+
+        ``alpha`` is a floating point value between 0 and 255.
+        """
+        self.image.set_alpha(alpha)
+        surface.blit(self.image, (x, y))
+
+
 class NumPyFadingImage(object):
     """An image that can smoothly fade away.
 
@@ -928,7 +984,7 @@ class HUDTitle(HUDElement):
         HUDElement.__init__(self, image.get_width(), image.get_height(),
                             xalign, yalign)
         self.alpha = 255
-        for cls in NumPyFadingImage, FadingImage:
+        for cls in AlphaFadingImage, NumPyFadingImage, FadingImage:
             try:
                 self.image = cls(image)
             except ImportError:
@@ -1099,15 +1155,18 @@ class HUDInput(HUDElement):
         self.ymargin = ymargin
         self.xpadding = xpadding
         self.ypadding = ypadding
+        self.buffer = None
 
     def draw(self, surface):
         """Draw the element."""
         surface_w, surface_h = surface.get_size()
         width = surface_w - 2*self.xmargin
         height = self.font.get_linesize() + 2*self.ypadding
-        buffer = pygame.Surface((width, height))
-        buffer.set_alpha(self.alpha)
-        buffer.set_colorkey((1, 1, 1))
+        buffer = self.buffer
+        if buffer is None or buffer.get_size() != (width, height):
+            buffer = self.buffer = pygame.Surface((width, height))
+            buffer.set_alpha(self.alpha)
+            buffer.set_colorkey((1, 1, 1))
         buffer.fill(self.bgcolor)
         img1 = self.font.render(self.prompt, True, self.color1)
         buffer.blit(img1, (self.xpadding, self.ypadding))
@@ -1890,6 +1949,7 @@ class GameUI(object):
     ZOOM_FACTOR = 1.25              # Keyboard zoom factor
 
     MAX_TRAIL = 100                 # Maximum missile trail length
+    MAX_SCALED_PLANETS = 50         # Maximum scaled planet images to keep
 
     fullscreen = False              # Start in windowed mode
     fullscreen_mode = None          # Desired video mode (w, h)
@@ -1924,6 +1984,7 @@ class GameUI(object):
 
     def __init__(self):
         self.rng = random.Random()
+        self.draw_methods = {}
         self.controls = {}
         for action in DEFAULT_CONTROLS:
             self.controls[action] = [None]
@@ -2078,6 +2139,8 @@ class GameUI(object):
             w, h = self.fullscreen_mode
             windowed_mode = (int(w * 0.8), int(h * 0.8))
             self.screen = pygame.display.set_mode(windowed_mode, RESIZABLE)
+        self.trail_pixels = {}
+        self.missile_pixels = {}
         self._prepare_background()
         if self.screen.get_bitsize() >= 24:
             # Only 24 and 32 bpp modes support aaline
@@ -2088,6 +2151,8 @@ class GameUI(object):
     def _resize_window(self, size):
         """Resize the PyGame window as requested."""
         self.screen = pygame.display.set_mode(size, RESIZABLE)
+        self.trail_pixels = {}
+        self.missile_pixels = {}
         self._prepare_background()
 
     def _optimize_images(self):
@@ -2098,6 +2163,7 @@ class GameUI(object):
         """
         self.planet_images = [img.convert_alpha()
                               for img in self.planet_images]
+        self.scaled_planet_images = {}
 
     def _load_planet_images(self):
         """Load bitmaps of planets."""
@@ -2573,8 +2639,14 @@ class GameUI(object):
             self.screen.blit(self.background_surface, (0, 0))
             if self.show_missile_trails:
                 self.draw_missile_trails()
+            draw_methods = self.draw_methods
             for obj in self.game.world.objects:
-                getattr(self, 'draw_' + obj.__class__.__name__)(obj)
+                cls = obj.__class__
+                draw = draw_methods.get(cls)
+                if draw is None:
+                    draw = getattr(self, 'draw_' + cls.__name__)
+                    draw_methods[cls] = draw
+                draw(obj)
             self.hud.draw(self.screen)
             self.ui_mode.draw(self.screen)
             self.time_to_draw = time.time() - start
@@ -2595,8 +2667,15 @@ class GameUI(object):
         """Draw a planet."""
         pos = self.viewport.screen_pos(planet.position)
         size = self.viewport.screen_len(planet.radius * 2)
-        unscaled_img = self.planet_images[planet.appearance]
-        img = pygame.transform.scale(unscaled_img, (size, size))
+        # Scaling is expensive, and the zoom level rarely changes
+        key = planet.appearance, size
+        img = self.scaled_planet_images.get(key)
+        if img is None:
+            if len(self.scaled_planet_images) >= self.MAX_SCALED_PLANETS:
+                self.scaled_planet_images.clear()
+            unscaled_img = self.planet_images[planet.appearance]
+            img = pygame.transform.scale(unscaled_img, (size, size))
+            self.scaled_planet_images[key] = img
         self.screen.blit(img, (pos[0] - size/2, pos[1] - size/2))
 
     def draw_Ship(self, ship):
@@ -2704,41 +2783,65 @@ class GameUI(object):
         """Update missile trails."""
         for missile, trail in list(self.missile_trails.items()):
             if missile.world is None:
-                del trail[:2]
+                trail.popleft()
+                if trail:
+                    trail.popleft()
                 if not trail:
                     del self.missile_trails[missile]
             else:
+                # the deque drops the oldest position by itself
                 trail.append(missile.position)
-                if len(trail) > self.MAX_TRAIL:
-                    del trail[0]
         for obj in self.game.world.objects:
             if isinstance(obj, Missile) and obj not in self.missile_trails:
-                self.missile_trails[obj] = [obj.position]
+                self.missile_trails[obj] = collections.deque([obj.position],
+                                                             self.MAX_TRAIL)
 
     def draw_missile_trails(self):
         """Draw missile trails."""
         start = time.time()
-        for missile, trail in self.missile_trails.items():
-            self.draw_missile_trail(missile, trail)
+        # Lock the screen once, instead of letting every set_at() do it
+        self.screen.lock()
+        try:
+            for missile, trail in self.missile_trails.items():
+                self.draw_missile_trail(missile, trail)
+        finally:
+            self.screen.unlock()
         self.time_to_draw_trails = time.time() - start
 
     def draw_missile_trail(self, missile, trail):
         """Draw a missile orbit trail."""
-        r, g, b = self.ship_colors[missile.appearance]
-        gradient = self.trail_colors[missile.appearance][len(trail)]
+        # set_at() is faster with colors already mapped to pixel values.
+        # The mapping depends on the display mode, hence the cache is reset
+        # whenever that changes.
+        key = missile.appearance, len(trail)
+        gradient = self.trail_pixels.get(key)
+        if gradient is None:
+            map_rgb = self.screen.map_rgb
+            gradient = self.trail_pixels[key] = [
+                map_rgb(color)
+                for color in self.trail_colors[missile.appearance][len(trail)]]
         self.viewport.draw_trail(trail, gradient, self.screen.set_at)
 
     def draw_Missile(self, missile):
         """Draw a missile."""
-        color = self.ship_colors[missile.appearance]
+        # Like trail colors, missile colors are mapped to pixel values once
+        # per display mode
+        colors = self.missile_pixels.get(missile.appearance)
+        if colors is None:
+            color = self.ship_colors[missile.appearance]
+            map_rgb = self.screen.map_rgb
+            colors = (map_rgb(color),
+                      map_rgb(colorblend(color, (0, 0, 0), 0.4)))
+            self.missile_pixels[missile.appearance] = colors
+        color, dim_color = colors
+        set_at = self.screen.set_at
         x, y = self.viewport.screen_pos(missile.position)
-        self.screen.set_at((x, y), color)
+        set_at((x, y), color)
         if self.viewport.scale > 0.5:
-            color = colorblend(color, (0, 0, 0), 0.4)
-            self.screen.set_at((x+1, y), color)
-            self.screen.set_at((x, y+1), color)
-            self.screen.set_at((x-1, y), color)
-            self.screen.set_at((x, y-1), color)
+            set_at((x+1, y), dim_color)
+            set_at((x, y+1), dim_color)
+            set_at((x-1, y), dim_color)
+            set_at((x, y-1), dim_color)
 
     def draw_Debris(self, debris):
         """Draw debris."""
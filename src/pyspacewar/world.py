@@ -5,6 +5,12 @@ The world of PySpaceWar
 import math
 import random
 import time
+from operator import itemgetter
+
+
+# Vector arithmetic creates a lot of short-lived vectors; calling
+# tuple.__new__ directly skips the Python-level Vector.__new__.
+_new_vector = tuple.__new__
 
 
 class Vector(tuple):
@@ -26,11 +32,10 @@ class Vector(tuple):
     __slots__ = ()
 
     # Nice accessories.  Sort of expensive, though: according to timeit,
-    # v.x is 5 times slower than v[0].  It would be possible to shave off
-    # 2.5 milliseconds off world update time by using [0], [1] instead of
-    # .x, .y everywhere.  Time to rewrite in C?
-    x = property(lambda self: self[0])
-    y = property(lambda self: self[1])
+    # v.x is still slower than v[0], so the arithmetic methods below unpack
+    # the tuple instead of using .x and .y.
+    x = property(itemgetter(0))
+    y = property(itemgetter(1))
 
     def __new__(cls, x, y):
         return tuple.__new__(cls, (x, y))
@@ -79,7 +84,8 @@ class Vector(tuple):
             Vector(4.5, 7.5)
 
         """
-        return Vector(self.x * factor, self.y * factor)
+        x, y = self
+        return _new_vector(Vector, (x * factor, y * factor))
 
     __rmul__ = __mul__
 
@@ -90,7 +96,7 @@ class Vector(tuple):
             7
 
         """
-        return self.x * other.x + self.y * other.y
+        return self[0] * other[0] + self[1] * other[1]
 
     def cross_product(self, other):
         """Compute the cross product of two vectors.
@@ -99,7 +105,7 @@ class Vector(tuple):
             11
 
         """
-        return self.x * other.y - self.y * other.x
+        return self[0] * other[1] - self[1] * other[0]
 
     def __truediv__(self, divisor):
         """Divide the vector by a scalar.
@@ -111,7 +117,9 @@ class Vector(tuple):
             (0.333, 0.667)
 
         """
-        return Vector(self.x / float(divisor), self.y / float(divisor))
+        x, y = self
+        divisor = float(divisor)
+        return _new_vector(Vector, (x / divisor, y / divisor))
 
     __div__ = __truediv__
 
@@ -122,7 +130,9 @@ class Vector(tuple):
             Vector(1.0, 5.5)
 
         """
-        return Vector(self.x + other.x, self.y + other.y)
+        x, y = self
+        ox, oy = other
+        return _new_vector(Vector, (x + ox, y + oy))
 
     def __sub__(self, other):
         """Subtract two vectors.
@@ -131,7 +141,9 @@ class Vector(tuple):
             Vector(2.0, -0.5)
 
         """
-        return Vector(self[0] - other[0], self[1] - other[1])
+        x, y = self
+        ox, oy = other
+        return _new_vector(Vector, (x - ox, y - oy))
 
     def __neg__(self):
         """Multiply the vector by -1.
@@ -140,7 +152,8 @@ class Vector(tuple):
             Vector(-1.5, -2.5)
 
         """
-        return Vector(-self.x, -self.y)
+        x, y = self
+        return _new_vector(Vector, (-x, -y))
 
     def length(self):
         """Compute the length of the vector.
@@ -166,7 +179,7 @@ class Vector(tuple):
             135.0
 
         """
-        angle = math.atan2(self.y, self.x) * 180 / math.pi
+        angle = math.atan2(self[1], self[0]) * 180 / math.pi
         if angle < 0:
             angle += 360
         return angle
@@ -181,7 +194,8 @@ class Vector(tuple):
             (-1.000, 2.000)
 
         """
-        return Vector(-self.y, self.x)
+        x, y = self
+        return _new_vector(Vector, (-y, x))
 
     def scaled(self, new_length=1.0):
         """Scale the vector to a given magnitude.
@@ -219,6 +233,7 @@ class World(object):
 
     GRAVITY = 0.01              # constant of gravitation
     BOUNCE_SPEED_LOSS = 0.1     # lose 10% speed when bouncing off something
+    SWEEP_AND_PRUNE_MIN = 16    # use sweep and prune for this many objects
 
     # Some debug information
     time_for_gravitation = 0    # Time to calculate gravitation
@@ -304,12 +319,14 @@ class World(object):
             obj.move(dt)
         # Collision detection: may affect positions and velocities
         start = time.time()
-        for n, obj1 in enumerate(self._objects_with_nonzero_radius):
-            for obj2 in (self._objects_with_nonzero_radius[n+1:] +
-                         self._objects_with_zero_radius):
-                if self.collide(obj1, obj2):
-                    obj1.collision(obj2)
-                    obj2.collision(obj1)
+        if len(self.objects) < self.SWEEP_AND_PRUNE_MIN:
+            pairs = self._all_pairs()
+        else:
+            pairs = self._overlapping_pairs()
+        for obj1, obj2 in pairs:
+            if self.collide(obj1, obj2):
+                obj1.collision(obj2)
+                obj2.collision(obj1)
         self.time_for_collisions = time.time() - start
         self._in_update = False
         if self._add_queue:
@@ -317,10 +334,78 @@ class World(object):
                 self.add(obj)
             self._add_queue = []
         if self._remove_queue:
-            for obj in self._remove_queue:
-                self.remove(obj)
+            self._remove_many(self._remove_queue)
             self._remove_queue = []
 
+    def _remove_many(self, objs):
+        """Remove several objects from the universe at once.
+
+        This is a single pass over the object lists, instead of one
+        list.remove() per object.  The order of the remaining objects is
+        preserved.
+        """
+        removed = set(objs)
+        for obj in removed:
+            obj.world = None
+        for objects in (self.objects, self._objects_with_nonzero_radius,
+                        self._objects_with_zero_radius):
+            objects[:] = [obj for obj in objects if obj not in removed]
+
+    def _all_pairs(self):
+        """Generate all pairs of objects that might collide.
+
+        Objects with zero radius never collide with each other, so those
+        pairs are skipped.  The first object in each pair has a nonzero
+        radius.
+        """
+        for n, obj1 in enumerate(self._objects_with_nonzero_radius):
+            for obj2 in (self._objects_with_nonzero_radius[n+1:] +
+                         self._objects_with_zero_radius):
+                yield obj1, obj2
+
+    def _overlapping_pairs(self):
+        """List pairs of objects that might collide (sweep and prune).
+
+        Two objects can only collide if their extents along the x axis
+        overlap.  Sort all objects by their leftmost x coordinate and sweep
+        from left to right, keeping a list of objects whose extents are
+        still open.  Objects with zero radius never need to be in that
+        list, since they cannot collide with each other.
+
+        Returns the same kinds of pairs as _all_pairs(), in the same order,
+        but usually a lot fewer of them.
+
+        Objects are not required to have a ``position`` (see add()); if
+        some don't, falls back to _all_pairs().
+        """
+        objects = (self._objects_with_nonzero_radius +
+                   self._objects_with_zero_radius)
+        try:
+            extents = [(obj.position[0] - obj.radius,
+                        obj.position[0] + obj.radius, n, obj)
+                       for n, obj in enumerate(objects)]
+        except AttributeError:
+            return list(self._all_pairs())
+        extents.sort(key=lambda extent: extent[0])
+        pairs = []
+        active = []
+        for xmin, xmax, n, obj in extents:
+            if active:
+                active = [(other_xmax, m, other)
+                          for other_xmax, m, other in active
+                          if other_xmax >= xmin]
+                for other_xmax, m, other in active:
+                    if m < n:
+                        pairs.append((m, n, other, obj))
+                    else:
+                        pairs.append((n, m, obj, other))
+            if obj.radius:
+                active.append((xmax, n, obj))
+        # collision() handlers can move objects (e.g. bounce()), so keep
+        # the order of _all_pairs() to get the same outcome
+        pairs.sort(key=lambda pair: pair[:2])
+        return [(obj1, obj2) for m, n, obj1, obj2 in pairs]
+
     def collide(self, obj1, obj2):
         """Check whether two objects collide."""
         collision_distance = obj1.radius + obj2.radius
@@ -419,8 +504,8 @@ class Object(object):
         dy = massive_object.position[1] - self.position[1]
         distance = math.hypot(dx, dy)
         f = self.world.GRAVITY * massive_object.mass * dt / distance ** 3
-        self.velocity = Vector(self.velocity[0] + dx * f,
-                               self.velocity[1] + dy * f)
+        vx, vy = self.velocity
+        self.velocity = _new_vector(Vector, (vx + dx * f, vy + dy * f))
 
     def move(self, dt):
         """Move for a particular time.
@@ -439,7 +524,10 @@ class Object(object):
             Vector(2.0, 4.0)
 
         """
-        self.position += self.velocity * dt
+        # self.position += self.velocity * dt, without the temporary vector
+        x, y = self.position
+        vx, vy = self.velocity
+        self.position = _new_vector(Vector, (x + vx * dt, y + vy * dt))
 
     def collision(self, other):
         """Handle a collision with another object.